@@ -100,12 +100,10 @@ def butter_bandpass(data,fs,lowpass,highpass,order=2):
     
     b, a = butter(order/2, [lowcut, highcut], btype='band')
     #mean_data=np.mean(data,axis=1)
-    y=np.zeros_like(data)
     #filter_dir = np.floor(order/2)
 
-    # filter once first 
-    for i in range(data.shape[0]):
-        y[i,:] = filtfilt(b, a, data[i,:])
+    # filter once first, all voxels/vertices at once along time
+    y = filtfilt(b, a, data, axis=1)
     
     # filter more if order is greater than 2,
     # then filter morei 
@@ -18,6 +18,7 @@ from nipype.interfaces.base import (
 from ..utils import(read_ndata, write_ndata, compute_FD,compute_dvars)
 from ..utils import plot_svg
 import pandas as pd
+import matplotlib.pyplot as plt
 from niworkflows.viz.plots import fMRIPlot
 from ..utils import regisQ
 LOGGER = logging.getLogger('nipype.interface')
@@ -75,11 +76,16 @@ class computeqcplot(SimpleInterface):
 
     def _run_interface(self, runtime):
         
-        conf_matrix = load_confound(datafile=self.inputs.bold_file)[0]
+        # only the motion parameters and rmsd are needed here
+        conf_matrix = load_confound(datafile=self.inputs.bold_file,
+                           usecols=["trans_x", "trans_y", "trans_z",
+                                    "rot_x", "rot_y", "rot_z", "rmsd"])[0]
         fd_timeseries = compute_FD(confound=conf_matrix, 
                            head_radius=self.inputs.head_radius)
     
-        rmsd = conf_matrix['rmsd']
+        # first rmsd entry is nan, the nan-aware reductions below skip it
+        # as the pandas ones did
+        rmsd = conf_matrix['rmsd'].to_numpy()
 
         if self.inputs.dummytime > 0:
             num_vold = np.int(self.inputs.dummytime/self.inputs.TR)
@@ -95,25 +101,32 @@ class computeqcplot(SimpleInterface):
         else: 
             nvolcensored = 0
         
-        dvars_bf = compute_dvars(read_ndata(datafile=self.inputs.bold_file,
-                                  maskfile=self.inputs.mask_file)[:,num_vold:])
-        dvars_af = compute_dvars(read_ndata(datafile=self.inputs.cleaned_file,
-                                  maskfile=self.inputs.mask_file))
+        # read each image once, the arrays are reused for dvars and the plots
+        datax = read_ndata(datafile=self.inputs.bold_file,
+                                  maskfile=self.inputs.mask_file)[:,num_vold:]
+        cleaned_data = read_ndata(datafile=self.inputs.cleaned_file,
+                                  maskfile=self.inputs.mask_file)
+        dvars_bf = compute_dvars(datax)
+        dvars_af = compute_dvars(cleaned_data)
 
         ## get qclplot 
         self._results['raw_qcplot'] = fname_presuffix('preprocess', suffix='_raw_qcplot.svg',
                                                    newpath=runtime.cwd, use_ext=False)
         self._results['clean_qcplot'] = fname_presuffix('postprocess', suffix='_clean_qcplot.svg',
                                                    newpath=runtime.cwd, use_ext=False) 
-        datax = read_ndata(datafile=self.inputs.bold_file,
-                                  maskfile=self.inputs.mask_file)[:,num_vold:]
         
-        # avoid tempfile tempfile for 
+        # niftis are always rewritten so the plot only shows voxels in the
+        # mask; a cifti is not masked, so without dummy volumes the bold
+        # file itself already holds the data to plot
         if self.inputs.bold_file.endswith('nii.gz'):
             filex = os.path.split(os.path.abspath(self.inputs.cleaned_file))[0]+'/plot_niftix.nii.gz'
+            write_ndata(data_matrix=datax,template=self.inputs.bold_file,
+                          mask=self.inputs.mask_file,filename=filex,tr=self.inputs.TR)
+        elif num_vold == 0:
+            filex = self.inputs.bold_file
         else:
             filex = os.path.split(os.path.abspath(self.inputs.cleaned_file))[0]+'/plot_ciftix.dtseries.nii'
-        write_ndata(data_matrix=datax,template=self.inputs.bold_file,
+            write_ndata(data_matrix=datax,template=self.inputs.bold_file,
                           mask=self.inputs.mask_file,filename=filex,tr=self.inputs.TR)
         
         conf = pd.DataFrame({ 'FD': fd_timeseries, 'DVARS': dvars_bf})
@@ -121,26 +134,30 @@ class computeqcplot(SimpleInterface):
         fig = fMRIPlot(func_file=filex,seg_file=self.inputs.seg_file,data=conf,
                     mask_file=self.inputs.mask_file).plot()
         fig.savefig(self._results['raw_qcplot'], bbox_inches='tight')
+        # release the figure before the next one is drawn
+        plt.close(fig)
 
         #plot_svg(fdata=datax,fd=fd_timeseries,dvars=dvars_bf,tr=self.inputs.TR,
                         #filename=self._results['raw_qcplot'])
 
         if nvolcensored > 0 :
-            mean_fd = np.mean(fd_timeseries[tmask==0])
-            mean_rms = np.mean (rmsd[tmask==0])
-            mdvars_bf = np.mean(dvars_bf[tmask==0])
-            mdvars_af = np.mean(dvars_af[tmask==0])
-            motionDVCorrInit = np.corrcoef(fd_timeseries[tmask==0],
-                               dvars_bf[tmask==0] )[0][1]
-            motionDVCorrFinal = np.corrcoef(fd_timeseries[tmask==0],
-                               dvars_af[tmask==0])[0][1]
-            rms_max = np.max(rmsd[tmask==0])
-
-            datax = read_ndata(datafile=self.inputs.cleaned_file,
-                                  maskfile=self.inputs.mask_file)
-            dataxx = datax[:,tmask==0]
-            confy = pd.DataFrame({ 'FD': fd_timeseries[tmask==0], 
-                         'DVARS': dvars_af[tmask==0]})
+            # retained volumes, computed once and reused for every metric
+            keep = tmask == 0
+            fd_keep = fd_timeseries[keep]
+            dvars_af_keep = dvars_af[keep]
+            mean_fd = np.mean(fd_keep)
+            mean_rms = np.nanmean(rmsd[keep])
+            mdvars_bf = np.mean(dvars_bf[keep])
+            mdvars_af = np.mean(dvars_af_keep)
+            motionDVCorrInit = np.corrcoef(fd_keep,
+                               dvars_bf[keep] )[0][1]
+            motionDVCorrFinal = np.corrcoef(fd_keep,
+                               dvars_af_keep)[0][1]
+            rms_max = np.nanmax(rmsd[keep])
+
+            dataxx = cleaned_data[:,keep]
+            confy = pd.DataFrame({ 'FD': fd_keep, 
+                         'DVARS': dvars_af_keep})
             if self.inputs.bold_file.endswith('nii.gz'):
                 filey = os.path.split(os.path.abspath(self.inputs.cleaned_file))[0]+'/plot_niftix1.nii.gz'
             else:
@@ -151,27 +168,27 @@ class computeqcplot(SimpleInterface):
             figy = fMRIPlot(func_file=filey,seg_file=self.inputs.seg_file,data=confy,
                     mask_file=self.inputs.mask_file).plot()
             figy.savefig(self._results['clean_qcplot'], bbox_inches='tight')
+            plt.close(figy)
             
             #plot_svg(fdata=dataxx,fd=fd_timeseries,dvars=dvars_af,tr=self.inputs.TR,
                              #filename=self._results['clean_qcplot'])
         else:
             mean_fd = np.mean(fd_timeseries)
-            mean_rms = np.mean (rmsd)
+            mean_rms = np.nanmean(rmsd)
             mdvars_bf = np.mean(dvars_bf)
             mdvars_af = np.mean(dvars_af)
             motionDVCorrInit = np.corrcoef(fd_timeseries,
                                dvars_bf)[0][1]
             motionDVCorrFinal = np.corrcoef(fd_timeseries,
                                dvars_af)[0][1]
-            rms_max = np.max(rmsd)
-            datax = read_ndata(datafile=self.inputs.cleaned_file,
-                                  maskfile=self.inputs.mask_file)
+            rms_max = np.nanmax(rmsd)
             confz = pd.DataFrame({ 'FD': fd_timeseries, 
                          'DVARS': dvars_af})
             
             figz = fMRIPlot(func_file=self.inputs.cleaned_file,seg_file=self.inputs.seg_file,
                     data=confz, mask_file=self.inputs.mask_file).plot()
             figz.savefig(self._results['clean_qcplot'], bbox_inches='tight')
+            plt.close(figz)
 
             #plot_svg(fdata=datax,fd=fd_timeseries,dvars=dvars_af,tr=self.inputs.TR,
                              #filename=self._results['clean_qcplot'])
@@ -133,18 +133,20 @@ def demean_detrend_data(data,TR,order):
     '''
     
     # demean the data first, check if it has been demean
-    if abs(np.mean(data)) > 1e-8:
-        mean_data =np.mean(data,axis=1)
-        means_expanded = np.outer(mean_data, np.ones(data.shape[1]))
-        demeand = data - means_expanded
+    # the grand mean is the mean of the row means, one pass gives both
+    mean_data = np.mean(data,axis=1)
+    if abs(np.mean(mean_data)) > 1e-8:
+        demeand = data - mean_data[:,None]
     else:
         demeand=data
 
+    # regress passes np.floor(...), a float, and vander needs an int degree
+    order = int(order)
     x = np.linspace(0,(data.shape[1]-1)*TR,num=data.shape[1])
-    predicted=np.zeros_like(demeand)
-    for j in range(demeand.shape[0]):
-        model = np.polyfit(x,demeand[j,:],order)
-        predicted[j,:] = np.polyval(model, x) 
+    # fit all rows in one least squares solve (one column per row of data)
+    # instead of a polyfit call per voxel
+    model = np.polyfit(x,demeand.T,order)
+    predicted = np.dot(np.vander(x,order+1),model).T
     return demeand - predicted
 
 class _ciftidespikeInputSpec(BaseInterfaceInputSpec):
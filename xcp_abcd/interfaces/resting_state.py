@@ -21,6 +21,8 @@ import tempfile
 from pkg_resources import resource_filename as pkgrf
 import numpy as np
 
+BRAINSPRITE_TEMPLATE = pkgrf('xcp_abcd','data/transform/brainsprite_template.html')
+
 # compute 2D reho
 class _surfaceRehoInputSpec(BaseInterfaceInputSpec):
     surf_bold = File(exists=True,mandatory=True, desc="left or right hemisphere gii ")
@@ -167,7 +169,7 @@ class brainplot(SimpleInterface):
         tempnifti = zscore_nifti(img=self.inputs.in_file,mask=self.inputs.mask_file,
                     outputname=tempnifti)
                     
-        temptlatehtml = pkgrf('xcp_abcd','data/transform/brainsprite_template.html')
+        temptlatehtml = BRAINSPRITE_TEMPLATE
 
         bsprite = viewer_substitute(threshold=0, opacity=0.5, title="zcore",
                          cut_coords=[0,0,0])
@@ -197,16 +199,20 @@ def zscore_nifti(img,outputname,mask=None):
     if mask:
         maskdata = nb.load(mask).get_fdata()
         imgdata  = img.get_fdata()
-        meandata = imgdata[maskdata>0].mean()
-        stddata  = imgdata[maskdata>0].std()
-        zscore_fdata = (imgdata - meandata)/stddata
+        # gather the in-mask values once for both statistics
+        brain = imgdata[maskdata>0]
+        meandata = brain.mean()
+        stddata  = brain.std()
+        zscore_fdata = imgdata - meandata
+        zscore_fdata /= stddata
         zscore_fdata[maskdata<1]= 0
     else:
         imgdata  = img.get_fdata()
-        meandata = imgdata[np.abs(imgdata)>0].mean()
-        stddata  = imgdata[np.abs(imgdata)>0].std()
-        zscore_fdata = (imgdata - meandata)/stddata
-        zscore_fdata[np.abs(imgdata)<0]= 0
+        brain = imgdata[np.abs(imgdata)>0]
+        meandata = brain.mean()
+        stddata  = brain.std()
+        zscore_fdata = imgdata - meandata
+        zscore_fdata /= stddata
 
     dataout = nb.Nifti1Image(zscore_fdata,affine=img.affine,header=img.header)
     dataout.to_filename(outputname)
@@ -6,6 +6,8 @@ import pandas as pd
 import nibabel as nb
 import numpy as np
 from shutil import copyfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import json
 import subprocess
 import h5py
@@ -24,6 +26,15 @@ os.makedirs(working_dir,exist_ok=True)
 function = str(sys.argv[1])
 subid = str(sys.argv[2])
 
+ENCODINGS = ("RL","LR")
+TASKS = ("REST1","REST2","WM","MOTOR","GAMBLING","EMOTION","LANGUAGE","SOCIAL")
+# sidecar shared by every dtseries
+CIFTI_JSON = {
+  "grayordinates": "91k", "space": "HCP grayordinates",
+  "surface": "fsLR","surface_density": "32k",
+  "volume": "MNI152NLin6Asym"
+  }
+
 """
 Data Narrative
 
@@ -38,20 +49,50 @@ All subjects ran successfully.
 """
 
 
+def list_subdirs(path):
+	'''
+	names of the directories in path; scandir gives the entry type
+	for free, so no extra stat per entry as with glob + isdir
+	'''
+	if not os.path.isdir(path):
+		return []
+	with os.scandir(path) as entries:
+		return sorted(e.name for e in entries if e.is_dir())
+
+
+# inputs every task directory must hold exactly one of, formatted with task and encoding
+REQUIRED_FILES = ('*Atlas_MSMAll.dtseries.nii', '*{0}_{1}.nii.gz', 'Movement_Regressors.txt',
+                  'Movement_AbsoluteRMS.txt', 'SBRef_dc.nii.gz', '*SBRef.nii.gz')
+
+
+def find_task_dir(results_dir,task_dirs,orig_task,fdir):
+	'''
+	name of the task directory (*{orig_task}*{fdir}*) in results_dir, or None
+	if the required inputs are missing. task_dirs is the list_subdirs of
+	results_dir, scanned once per subject instead of globbed per check
+	'''
+	matches = [d for d in task_dirs
+			   if orig_task in d and fdir in d[d.index(orig_task)+len(orig_task):]]
+	if not matches:
+		return None
+	for pattern in REQUIRED_FILES:
+		pattern = pattern.format(orig_task,fdir)
+		nfound = sum(len(glob.glob(os.path.join(results_dir,d,pattern))) for d in matches)
+		if nfound != 1:
+			return None
+	return matches[0]
+
+
 def audit():
-	df = pd.DataFrame(columns=['ran','subject','error'])
+	audit_ran, audit_subject, audit_error = [], [], []
 
-	for sub in glob.glob('/cbica/projects/HCP_Data_Releases/HCP_1200/**'):
-		subid = sub.split('/')[-1]
+	for subid in list_subdirs(hcp_dir):
+		results_dir = '/{0}/{1}/MNINonLinear/Results/'.format(hcp_dir,subid)
+		task_dirs = list_subdirs(results_dir)
 		data = []
-		for fdir in ["RL","LR"]:
-			for orig_task in ["REST1","REST2","WM","MOTOR","GAMBLING","EMOTION","LANGUAGE","SOCIAL"]:
-				if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/*Atlas_MSMAll.dtseries.nii'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-				if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/*{2}_{3}.nii.gz'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-				if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/Movement_Regressors.txt'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-				if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/Movement_AbsoluteRMS.txt'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-				if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/SBRef_dc.nii.gz'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-				if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/**SBRef.nii.gz'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
+		for fdir in ENCODINGS:
+			for orig_task in TASKS:
+				if find_task_dir(results_dir,task_dirs,orig_task,fdir) is None: continue
 				data.append('_'.join([orig_task,fdir]))
 
 		results = []
@@ -73,11 +114,10 @@ def audit():
 		# 		for line in f:
 		# 			pass
 		# 	print (subid,line)
-		sdf = pd.DataFrame(columns=['ran','subject','error'])
-		sdf['ran'] = [ran]
-		sdf['subject'] = [subid]
-		sdf['error'] = [line]
-		df =df.append(sdf,ignore_index=True)
+		audit_ran.append(ran)
+		audit_subject.append(subid)
+		audit_error.append(line)
+	df = pd.DataFrame({'ran':audit_ran,'subject':audit_subject,'error':audit_error})
 	df.to_csv('/cbica/home/bertolem/xcp_hcp/xcp_results/xcp_abcd/audit.csv',index=False)
 
 def remove(subid):
@@ -88,8 +128,7 @@ def remove(subid):
 if function == 'sge':
 	audit()
 	audit = pd.read_csv('/cbica/home/bertolem/xcp_hcp/xcp_results/xcp_abcd/audit.csv')
-	for sub in glob.glob('/cbica/projects/HCP_Data_Releases/HCP_1200/**'):
-		sub = sub.split('/')[-1]
+	for sub in list_subdirs(hcp_dir):
 		if audit[audit.subject==sub].ran.values[0]:
 			remove(sub)
 			continue
@@ -107,16 +146,12 @@ if function == 'run':
 	# for fdir in ["RL"]:
 	# 	for orig_task in ["REST1"]:
 
-	for fdir in ["RL","LR"]:
-		for orig_task in ["REST1","REST2","WM","MOTOR","GAMBLING","EMOTION","LANGUAGE","SOCIAL"]:
-			if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/*Atlas_MSMAll.dtseries.nii'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-			if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/*{2}_{3}.nii.gz'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-			if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/Movement_Regressors.txt'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-			if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/Movement_AbsoluteRMS.txt'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-			if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/SBRef_dc.nii.gz'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-			if len(glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*/**SBRef.nii.gz'.format(hcp_dir,subid,orig_task,fdir))) != 1: continue
-			tdir = glob.glob('/{0}/{1}/MNINonLinear/Results/*{2}*{3}*'.format(hcp_dir,subid,orig_task,fdir))[0]
-			task = tdir.split('/')[-1]
+	results_dir = '/{0}/{1}/MNINonLinear/Results/'.format(hcp_dir,subid)
+	task_dirs = list_subdirs(results_dir)
+	for fdir in ENCODINGS:
+		for orig_task in TASKS:
+			task = find_task_dir(results_dir,task_dirs,orig_task,fdir)
+			if task is None: continue
 			tasklist.append(task)
 			task_dir = '/{0}/S1200/{1}/MNINonLinear/Results/{2}'.format(working_dir,subid,task)
 
@@ -124,8 +159,9 @@ if function == 'run':
 			os.chdir(task_dir)
 
 			wbs_file = '{0}/{1}/MNINonLinear/Results/{2}/{2}_Atlas_MSMAll.dtseries.nii'.format(hcp_dir,subid,task)
+			wbs_out = '/{0}/{1}_WBS.txt'.format(task_dir,task)
 			if os.path.exists(wbs_file):
-				command = 'OMP_NUM_THREADS=4 wb_command -cifti-stats {0} -reduce MEAN >> /{1}/{2}_WBS.txt'.format(wbs_file,task_dir,task)
+				command = 'OMP_NUM_THREADS=4 wb_command -cifti-stats {0} -reduce MEAN > {1}'.format(wbs_file,wbs_out)
 				os.system(command)
 
 
@@ -148,13 +184,16 @@ if function == 'run':
 			ResultsFolder='/{0}/{1}/MNINonLinear/Results/{2}/'.format(hcp_dir,subid,j)
 			ROIFolder="/{0}/{1}/MNINonLinear/ROIs".format(hcp_dir,subid)
 
-			xcp_file = '/{0}/S1200/{1}/MNINonLinear/Results/{2}/{3}_WM.txt'.format(working_dir,subid,j,j)
-			cmd = "fslmeants -i {0}/{1}.nii.gz -o {2} -m {3}/WMReg.2.nii.gz".format(ResultsFolder,j,xcp_file,ROIFolder)
-			os.system(cmd)
+			bold_orig = '{0}/{1}.nii.gz'.format(ResultsFolder,j)
 
-			xcp_file = '/{0}/S1200/{1}/MNINonLinear/Results/{2}/{3}_CSF.txt'.format(working_dir,subid,j,j)
-			cmd = "fslmeants -i {0}/{1}.nii.gz -o {2} -m {3}/CSFReg.2.nii.gz".format(ResultsFolder,j,xcp_file,ROIFolder)
-			os.system(cmd)
+			# WM and CSF means read the same bold, run them side by side
+			# so the second read comes from the page cache
+			cmds = []
+			for tissue,roi in [('WM','WMReg.2.nii.gz'),('CSF','CSFReg.2.nii.gz')]:
+				xcp_file = '/{0}/S1200/{1}/MNINonLinear/Results/{2}/{3}_{4}.txt'.format(working_dir,subid,j,j,tissue)
+				cmds.append("fslmeants -i {0} -o {1} -m {2}/{3}".format(bold_orig,xcp_file,ROIFolder,roi))
+			with ThreadPoolExecutor(max_workers=2) as executor:
+				list(executor.map(os.system,cmds))
 
 
 		orig = '/{0}/{1}/MNINonLinear/Results/{2}/Movement_Regressors.txt'.format(hcp_dir,subid,j)
@@ -166,9 +205,9 @@ if function == 'run':
 		copyfile(orig,xcp_file)
 
 		##create confound regressors
-		mvreg = pd.read_csv(datadir +'/Movement_Regressors.txt',header=None,delimiter=r"\s+")
-		mvreg = mvreg.iloc[:,0:6]
-		mvreg.columns=['trans_x','trans_y','trans_z','rot_x','rot_y','rot_z']
+		# only the first six columns are used, skip the rest in the reader
+		mvreg = np.loadtxt(datadir +'/Movement_Regressors.txt',usecols=range(6))
+		mvreg = pd.DataFrame(mvreg,columns=['trans_x','trans_y','trans_z','rot_x','rot_y','rot_z'])
 		# convert rot to rad
 		mvreg['rot_x']=mvreg['rot_x']*np.pi/180
 		mvreg['rot_y']=mvreg['rot_y']*np.pi/180
@@ -197,18 +236,22 @@ if function == 'run':
 
 		regressors  =  pd.concat([mvreg, brainreg], axis=1)
 		jsonreg =  pd.DataFrame({'LR': [1,2,3]}) # just a fake json
-		regressors.to_csv(funcdir+'sub-'+subid+'_task-'+taskname+'_acq-'+acqname+'_desc-confounds_timeseries.tsv',index=False,
-						  sep= '\t')
+		np.savetxt(funcdir+'sub-'+subid+'_task-'+taskname+'_acq-'+acqname+'_desc-confounds_timeseries.tsv',
+				   regressors.to_numpy(),delimiter='\t',header='\t'.join(regressors.columns),
+				   comments='',fmt='%.10g')
 		regressors.to_json(funcdir+'sub-'+subid+'_task-'+taskname+'_acq-'+acqname+'_desc-confounds_timeseries.json')
 
 
+		# source file -> list of fmriprep-style destinations
+		copy_dictionary = defaultdict(list)
+
 		hcp_mask = '/{0}/{1}//MNINonLinear/Results/{2}/{2}_SBRef.nii.gz'.format(hcp_dir,subid,j)
 		prep_mask = funcdir+'/sub-'+subid+'_task-'+taskname+'_acq-'+ acqname +'_space-MNI152NLin6Asym_boldref.nii.gz'
-		copyfile(hcp_mask,prep_mask)
+		copy_dictionary[hcp_mask].append(prep_mask)
 
 		hcp_mask = '/{0}/{1}//MNINonLinear/Results/{2}/brainmask_fs.2.nii.gz'.format(hcp_dir,subid,j)
 		prep_mask = funcdir+'/sub-'+subid+'_task-'+taskname+'_acq-'+ acqname +'_space-MNI152NLin6Asym_desc-brain_mask.nii.gz'
-		copyfile(hcp_mask,prep_mask)
+		copy_dictionary[hcp_mask].append(prep_mask)
 
 		# create/copy  cifti
 		niftip  = '{0}/{1}/MNINonLinear/Results/{2}/{2}.nii.gz'.format(hcp_dir,subid,j,j) # to get TR  and just sample
@@ -216,8 +259,8 @@ if function == 'run':
 		ciftip = datadir + '/'+ j +'_Atlas_MSMAll.dtseries.nii'
 		ciftib = funcdir+'/sub-'+subid+'_task-'+taskname+'_acq-'+ acqname +'_space-fsLR_den-91k_bold.dtseries.nii'
 
-		os.system('cp {0} {1}'.format(ciftip,ciftib))
-		os.system('cp {0} {1}'.format(niftip,niftib))
+		copy_dictionary[ciftip].append(ciftib)
+		copy_dictionary[niftip].append(niftib)
 
 		tr = nb.load(niftip).header.get_zooms()[-1]   # repetition time
 
@@ -225,18 +268,12 @@ if function == 'run':
 		 "RepetitionTime": np.float(tr),
 		 "TaskName": taskname
 		}
-		json2={
-		  "grayordinates": "91k", "space": "HCP grayordinates",
-		  "surface": "fsLR","surface_density": "32k",
-		  "volume": "MNI152NLin6Asym"
-		  }
-
 
 		with open(funcdir+'/sub-'+subid+'_task-'+taskname+'_acq-'+ acqname +'_space-MNI152NLin6Asym_desc-preproc_bold.json', 'w') as outfile:
 			json.dump(jsontis, outfile)
 
 		with open(funcdir+'/sub-'+subid+'_task-'+taskname+'_acq-'+ acqname +'_space-fsLR_den-91k_bold.dtseries.json', 'w') as outfile:
-			json.dump(json2, outfile)
+			json.dump(CIFTI_JSON, outfile)
 
 		# just fake anatomical profile for xcp, it wont be use
 		orig = '/{0}/{1}/MNINonLinear/Results/{2}/SBRef_dc.nii.gz'.format(hcp_dir,subid,j)
@@ -245,10 +282,12 @@ if function == 'run':
 		anat1 = datadir +'/' +'/SBRef_dc.nii.gz'
 		mni2t1 = anatdir+'sub-'+subid+'_from-MNI152NLin2009cAsym_to-T1w_mode-image_xfm.h5'
 		t1w2mni = anatdir+'sub-'+subid+'_from-T1w_to-MNI152NLin2009cAsym_mode-image_xfm.h5'
-		cmd = 'cp {0} {1}'.format(anat1,mni2t1)
-		os.system(cmd)
-		cmd = 'cp {0} {1}'.format(anat1,t1w2mni)
-		os.system(cmd)
+		copy_dictionary[anat1].append(mni2t1)
+		copy_dictionary[anat1].append(t1w2mni)
+
+		for orig_file, xcp_files in copy_dictionary.items():
+			for xcp_file in xcp_files:
+				copyfile(orig_file,xcp_file)
 
 	os.chdir(working_dir)
 	# singularity build xcp-abcd-latest.sif docker://pennlinc/xcp_abcd:latest
@@ -268,9 +307,9 @@ if function == 'zipit':
 	# audit()
 	# audit = pd.read_csv('/cbica/home/bertolem/xcp_hcp/xcp_results/xcp_abcd/audit.csv')
 
-	df = pd.DataFrame()
-	for csv in glob.glob('/cbica/home/bertolem/xcp_hcp/xcp_results/xcp_abcd/**/func/*qc_den-91k_bold.tsv'):
-		df = df.append(pd.read_csv(csv),ignore_index=True)
+	df = pd.concat([pd.read_csv(csv) for csv in
+		glob.glob('/cbica/home/bertolem/xcp_hcp/xcp_results/xcp_abcd/**/func/*qc_den-91k_bold.tsv')],
+		ignore_index=True)
 
 	df = df.sort_values('sub',axis=0)
 
@@ -280,21 +319,19 @@ if function == 'zipit':
 
 	data = h5py.File("hcp_rbc_bold.hdf5", "w")
 	for parcel in parcels:
-		for matrix in df.iterrows():
-			matrix = dict(matrix[1])
+		for matrix in df.to_dict('records'):
 			fname = '/cbica/home/bertolem/xcp_hcp/xcp_results/xcp_abcd/sub-{0}/func/sub-{0}_task-{1}_acq-{3}_space-fsLR_atlas-{2}_den-91k_den-91k_bold.pconn.nii'.format(matrix['sub'],matrix['task'],parcel,matrix['acq'])
 			m = nb.load(fname).get_fdata()
 			fname.replace('.pconn.nii','').split('/')[-1]
-			data.create_dataset('bold/{0}/matrix/{1}'.format(matrix['sub'],fname),m.shape,dtype=float,data=m)
-			for key in matrix.keys():
-				data['bold/{0}/matrix/{1}'.format(matrix['sub'],fname)].attrs[key] = matrix[key]
+			dset = data.create_dataset('bold/{0}/matrix/{1}'.format(matrix['sub'],fname),m.shape,dtype=float,data=m)
+			dset.attrs.update(matrix)
 
 			fname = '/cbica/home/bertolem/xcp_hcp/xcp_results/xcp_abcd/sub-{0}/func/sub-{0}_task-{1}_acq-{3}_space-fsLR_atlas-{2}_den-91k_den-91k_bold.ptseries.nii'.format(matrix['sub'],matrix['task'],parcel,matrix['acq'])
 			m = nb.load(fname).get_fdata()
 			fname.replace('.ptseries.nii','').split('/')[-1]
-			data.create_dataset('bold/{0}/timeseries/{1}'.format(matrix['sub'],fname),m.shape,dtype=float,data=m)
-			for key in matrix.keys():
-				data['bold/{0}/timeseries/{1}'.format(matrix['sub'],fname)].attrs[key] = matrix[key]
+			dset = data.create_dataset('bold/{0}/timeseries/{1}'.format(matrix['sub'],fname),m.shape,dtype=float,data=m)
+			dset.attrs.update(matrix)
+	data.close()
 
 
 
@@ -322,8 +359,7 @@ def regression(data,confound):
 def make_hcp():
 	os.system('rm /cbica/home/bertolem/xcp_hcp/WBS.txt')
 
-	for sub in glob.glob('/cbica/projects/HCP_Data_Releases/HCP_1200/**'):
-		subject = sub.split('/')[-1]
+	for subject in list_subdirs(hcp_dir):
 		if subject == 'ToSync':
 			continue
 		files = glob.glob('/cbica/projects/HCP_Data_Releases/HCP_1200/{0}/MNINonLinear/Results/*rfMRI_REST*/rfMRI_**_Atlas_MSMAll_hp2000_clean.dtseries.nii'.format(subject))
@@ -0,0 +1,39 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the surface adjacency used by ReHo."""
+import numpy as np
+from xcp_abcd.utils.fcon import _faces_to_adjacency
+
+
+def _dense_adjacency(faces, n_vertices):
+    # the dense face loop the sparse construction replaced
+    A = np.zeros([n_vertices, n_vertices], dtype=np.uint8)
+    for i in range(1, len(faces)):
+        A[faces[i, 0], faces[i, 2]] = 1
+        A[faces[i, 1], faces[i, 1]] = 1
+        A[faces[i, 2], faces[i, 0]] = 1
+    return A + A.T
+
+
+def test_two_triangles_match_dense_loop():
+    # two triangles sharing the 1-2 edge
+    faces = np.array([[0, 1, 2], [1, 2, 3]])
+    adjacency = _faces_to_adjacency(faces, 4)
+
+    np.testing.assert_array_equal(adjacency.toarray(),
+                                  _dense_adjacency(faces, 4))
+    # the loop skipped the first face and only set (f0,f2) and (f1,f1)
+    # of the second, before symmetrising
+    expected = np.zeros((4, 4), dtype=np.uint8)
+    expected[1, 3] = expected[3, 1] = 2
+    expected[2, 2] = 2
+    np.testing.assert_array_equal(adjacency.toarray(), expected)
+
+
+def test_random_mesh_matches_dense_loop():
+    rng = np.random.RandomState(0)
+    faces = rng.randint(0, 50, size=(200, 3))
+    adjacency = _faces_to_adjacency(faces, 50)
+
+    np.testing.assert_array_equal(adjacency.toarray(),
+                                  _dense_adjacency(faces, 50))
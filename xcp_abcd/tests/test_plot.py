@@ -0,0 +1,64 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the confound plots."""
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib import gridspec as mgs
+from matplotlib.collections import LineCollection
+from xcp_abcd.utils.plot import _m4_aggregate, confoundplot
+
+
+def test_short_series_is_not_downsampled():
+    tseries = np.random.RandomState(0).randn(30)
+    # fewer samples than four per bucket, even fewer than the buckets
+    for n_pixels in (10, 100):
+        xvals, yvals = _m4_aggregate(tseries, n_pixels)
+        np.testing.assert_array_equal(xvals, np.arange(30))
+        np.testing.assert_array_equal(yvals, tseries)
+
+
+def test_series_with_nan_is_not_downsampled():
+    tseries = np.random.RandomState(0).randn(1000)
+    tseries[[0, 500, 999]] = np.nan
+    xvals, yvals = _m4_aggregate(tseries, 10)
+    np.testing.assert_array_equal(xvals, np.arange(1000))
+    np.testing.assert_array_equal(yvals, tseries)
+
+
+def test_constant_series_keeps_bucket_edges():
+    tseries = np.full(1000, 3.)
+    xvals, yvals = _m4_aggregate(tseries, 10)
+    # argmin/argmax of a constant bucket are its first sample
+    starts = np.arange(0, 1000, 100)
+    np.testing.assert_array_equal(xvals,
+                                  np.union1d(starts, starts + 99))
+    assert (yvals == 3.).all()
+
+
+def test_extremes_and_ends_of_every_bucket_are_kept():
+    tseries = np.random.RandomState(0).randn(1003)
+    xvals, yvals = _m4_aggregate(tseries, 10)
+
+    assert xvals[0] == 0 and xvals[-1] == 1002
+    assert (np.diff(xvals) > 0).all()
+    np.testing.assert_array_equal(yvals, tseries[xvals])
+    # uneven tail: buckets of 101 samples, the last one shorter
+    for start in range(0, 1003, 101):
+        bucket = tseries[start:start + 101]
+        kept = yvals[(xvals >= start) & (xvals < start + 101)]
+        assert kept.min() == bucket.min()
+        assert kept.max() == bucket.max()
+
+
+def test_confoundplot_draws_and_labels_cutoffs():
+    fig = plt.figure()
+    grid = mgs.GridSpec(1, 1)
+    tseries = np.random.RandomState(0).rand(100)
+    ax_ts, _ = confoundplot(tseries, grid[0], tr=2., cutoff=[0.2, 0.5])
+
+    lines = [c for c in ax_ts.collections if isinstance(c, LineCollection)]
+    assert len(lines) == 1
+    assert len(lines[0].get_segments()) == 2
+    labels = [t.get_text() for t in ax_ts.texts]
+    assert '0.20' in labels and '0.50' in labels
+    plt.close(fig)
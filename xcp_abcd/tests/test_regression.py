@@ -0,0 +1,32 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the demeaning and detrending used by regress."""
+import numpy as np
+from xcp_abcd.interfaces.regression import demean_detrend_data
+
+
+def _detrend_per_row(data, TR, order):
+    # one polyfit/polyval per row, as before the batched fit
+    demeand = data - np.mean(data, axis=1)[:, None]
+    x = np.linspace(0, (data.shape[1] - 1) * TR, num=data.shape[1])
+    detrended = np.zeros_like(demeand)
+    for i in range(demeand.shape[0]):
+        model = np.polyfit(x, demeand[i], order)
+        detrended[i] = demeand[i] - np.polyval(model, x)
+    return detrended
+
+
+def test_float_order_as_passed_by_regress():
+    rng = np.random.RandomState(0)
+    TR = 2.
+    data = rng.randn(20, 120) + np.linspace(0, 5, 120) + 100
+    # regress computes the order with np.floor, which returns a float
+    order = np.floor(1 + data.shape[1] * TR / 150)
+    assert isinstance(order, np.floating)
+
+    detrended = demean_detrend_data(data=data, TR=TR, order=order)
+
+    assert detrended.shape == data.shape
+    np.testing.assert_allclose(detrended,
+                               _detrend_per_row(data, TR, int(order)),
+                               atol=1e-10)
@@ -7,11 +7,13 @@ import pandas as pd
 import sys
 import os  
 
-def load_confound(datafile):
+def load_confound(datafile,usecols=None):
     """`Load confound amd json."""
     '''
     datafile:
         real nifti or cifti file 
+    usecols:
+        optional list of columns to parse, None reads all of them
     confoundpd:
         confound data frame
     confoundjs: 
@@ -26,7 +28,8 @@ def load_confound(datafile):
         confounds_timeseries = datafile.split('_desc-preproc_bold.nii.gz')[0]+"_desc-confounds_timeseries.tsv"
         confounds_json = datafile.split('_desc-preproc_bold.nii.gz')[0]+"_desc-confounds_timeseries.json"
             
-    confoundpd = pd.read_csv(confounds_timeseries, delimiter="\t", encoding="utf-8")
+    confoundpd = pd.read_csv(confounds_timeseries, delimiter="\t", encoding="utf-8",
+                             usecols=usecols)
     
     confoundjs = readjson(confounds_json)
 
@@ -180,9 +183,7 @@ def motion_regression_filter(data,fs,filtertype,cutoff,freqband,order=4):
     order_apply = np.int(np.floor(order/2))
 
     for j in range(order_apply):
-        for k in range(data.shape[0]):
-            data[k,:] = filtfilt(b,a,data[k,:])
-        j=j+1
+        data = filtfilt(b,a,data,axis=1)
     
     return data 
     
@@ -3,10 +3,11 @@
 """
 nifti functional connectivity
 """
+from functools import lru_cache
 from nilearn.input_data import NiftiLabelsMasker
 import numpy as np 
 from scipy.stats import rankdata
-from scipy import signal
+from scipy import signal, sparse
 import nibabel as nb 
 from templateflow.api import get as get_template
 
@@ -45,34 +46,34 @@ def compute_2d_reho(datat,adjacency_matrix):
 
     datat: numpy darray
        data matrix in vertices by timepoints
-    adjacency_matrix : numpy matrix 
+    adjacency_matrix : numpy or scipy sparse matrix
        surface adjacency matrix 
 
     """
-    KCC = np.zeros(datat.shape[0])
-    
-    for i in range(datat.shape[0]):
-        neigbor_index = np.where(adjacency_matrix[i,:]>0)[0]
-        nn = np.hstack((neigbor_index,np.array(i)))
-        neidata = datat[nn,:]
-        
-        rankeddata=np.zeros_like(neidata)
-        neigbor,timepoint=neidata.shape[0],neidata.shape[1]
-        
-        for j in range(neidata.shape[0]):
-            rankeddata[j,:] = rankdata(neidata[j,])
-        rankmean = np.sum(rankeddata,axis=0)
-        
-        KC = np.sum(np.power(rankmean,2)) - \
-               timepoint*np.power(np.mean(rankmean),2)
-        
-        denom = np.power(neigbor,2)*(np.power(timepoint,3) - timepoint)
-        
-        KCC[i] =  12*KC/(denom)
-        
+    # rank every timeseries once, then the rank sum of a neighbourhood
+    # (the vertex itself is always added to its neighbours) is a sparse
+    # matrix product instead of a rankdata call per neighbour per vertex.
+    # Ranks (tied ones averaged to .5) are exact in float32, which halves
+    # the rank buffer; the sums are accumulated in float64
+    ranked = rankdata(datat, axis=1).astype(np.float32)
+    neighbours = sparse.csr_matrix(adjacency_matrix > 0, dtype=np.float64)
+    rankmean = neighbours.dot(ranked)
+    rankmean += ranked
+
+    neigbor = np.asarray(neighbours.sum(axis=1)).ravel() + 1
+    timepoint = datat.shape[1]
+
+    KC = np.sum(np.power(rankmean,2),axis=1) - \
+           timepoint*np.power(np.mean(rankmean,axis=1),2)
+
+    denom = np.power(neigbor,2)*(np.power(timepoint,3) - timepoint)
+
+    KCC = 12*KC/(denom)
+
     return KCC
 
 
+@lru_cache(maxsize=2)
 def mesh_adjacency(hemi):
     # surface sphere to be load from templateflow 
     # either left or right hemisphere 
@@ -84,13 +85,24 @@ def mesh_adjacency(hemi):
 
     vertices = vertices_faces[0]
     faces = vertices_faces[1]
-    A = np.zeros([len(vertices),len(vertices)],dtype=np.uint8)
 
-    for i in range(1,len(faces)):
-        A[faces[i,0],faces[i,2]]=1
-        A[faces[i,1],faces[i,1]]=1
-        A[faces[i,2],faces[i,0]]=1
-                   
+    return _faces_to_adjacency(faces,len(vertices))
+
+
+def _faces_to_adjacency(faces,n_vertices):
+    """
+    sparse (csr) vertex adjacency of a triangle mesh, a dense
+    vertices x vertices matrix is ~1 GB on fsLR
+    """
+    # the same entries the dense loop set for every face but the first:
+    # (f0,f2), (f1,f1) and (f2,f0), then symmetrised as A + A.T
+    faces = faces[1:]
+    rows = np.concatenate([faces[:,0],faces[:,1],faces[:,2]])
+    cols = np.concatenate([faces[:,2],faces[:,1],faces[:,0]])
+    A = sparse.coo_matrix((np.ones(len(rows),dtype=np.uint8),(rows,cols)),
+                          shape=(n_vertices,n_vertices)).tocsr()
+    # repeated entries are summed by the conversion, the loop assigned 1
+    A.data[:] = 1
     return A + A.T
 
 
@@ -109,12 +121,16 @@ def compute_alff(data_matrix,low_pass,high_pass, TR):
        repetition time in seconds
     """
     fs=1/TR
-    alff = np.zeros(data_matrix.shape[0])
-    for i in range(data_matrix.shape[0]):
-        fx, Pxx_den = signal.periodogram(data_matrix[i,:], fs,scaling='spectrum')
-        #fx, Pxx_den = signal.periodogram(data_matrix[i,:], fs,scaling='density')
-        pxx_sqrt = np.sqrt(Pxx_den)
-        ff_alff = [np.argmin(np.abs(fx-high_pass)),np.argmin(np.abs(fx-low_pass))]
-        alff[i] = len(ff_alff)*np.mean(pxx_sqrt[ff_alff[0]:ff_alff[1]])
+    # one batched periodogram over all voxels, the frequencies are shared
+    fx, Pxx_den = signal.periodogram(data_matrix, fs,scaling='spectrum',axis=1)
+    #fx, Pxx_den = signal.periodogram(data_matrix, fs,scaling='density',axis=1)
+    # fx is sorted: the nearest bin to each cutoff is one of the two around
+    # its insertion point (ties go to the lower bin, as argmin did)
+    cutoffs = np.array([high_pass,low_pass])
+    idx = np.clip(np.searchsorted(fx,cutoffs),1,len(fx)-1)
+    ff_alff = idx - ((cutoffs-fx[idx-1]) <= (fx[idx]-cutoffs))
+    # only the band enters alff, take the amplitude of that slice alone
+    pxx_sqrt = np.sqrt(Pxx_den[:,ff_alff[0]:ff_alff[1]])
+    alff = len(ff_alff)*np.mean(pxx_sqrt,axis=1)
     alff = np.reshape(alff,[len(alff),1])
     return alff
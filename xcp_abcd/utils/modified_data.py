@@ -4,7 +4,6 @@
 
 import numpy as np
 import pandas as pd
-from numpy import matlib
 
 def drop_tseconds_volume(data_matrix,confound,delets=0,TR=1,custom_conf=None):
     
@@ -131,66 +130,55 @@ def interpolate_masked_data(img_datax,tmask,mask_data=None,
         angular_frequencies = 2 * np.pi * sampling_frequencies
     
     # Constant offsets
-        offsets = np.arctan2(np.sum(np.sin(2*np.outer(angular_frequencies, seen_samples)), 1),
-            np.sum(np.cos(2*np.outer(angular_frequencies, seen_samples)),1)
+        phase = np.outer(angular_frequencies, seen_samples)
+        offsets = np.arctan2(np.sum(np.sin(2*phase), 1),
+            np.sum(np.cos(2*phase),1)
             ) / (2 * angular_frequencies)
     
-    # Prepare sin and cos basis terms
+    # Prepare sin and cos basis terms, the offset is broadcast over samples
+        phase -= (angular_frequencies*offsets)[:,None]
+        cosine_term = np.cos(phase)
+        sine_term = np.sin(phase)
+        cosine_denominator = np.sum(cosine_term**2,1)
+        sine_denominator = np.sum(sine_term**2,1)
 
-        cosine_term = np.cos(np.outer(angular_frequencies, seen_samples) -
-                matlib.repmat(angular_frequencies*offsets, n_samples_seen, 1).T)
-        sine_term = np.sin(np.outer(angular_frequencies, seen_samples) -
-             matlib.repmat(angular_frequencies*offsets, n_samples_seen, 1).T)
+    # Basis over all observations for the reconstruction, the same for
+    # every voxel bin
+        recon_phase = np.outer(angular_frequencies, all_samples)
+        sine_recon = np.sin(recon_phase).T
+        cosine_recon = np.cos(recon_phase).T
+        del recon_phase
 
         n_voxel_bins = int(np.ceil(nvox /voxbin))
 
         for current_bin in range(1,n_voxel_bins+2):
             print('Voxel bin ' + str(current_bin) + ' out of ' + str(n_voxel_bins+1))
    
-        # Extract the seen samples for the current bin
-            bin_index = np.arange(start=(current_bin-1)*(voxbin-1),
-                                          stop=current_bin*voxbin)
-            bin_index = np.intersect1d(bin_index, range(0,nvox))
-            voxel_bin = img_data[bin_index,:][:,t_obs.ravel()]
-            n_features = voxel_bin.shape[0]
+        # Extract the seen samples for the current bin. The bin is a
+        # contiguous run of voxels, so a slice (clipped to nvox) replaces
+        # building and intersecting index arrays
+            bin_start = (current_bin-1)*(voxbin-1)
+            bin_stop = min(current_bin*voxbin, nvox)
+            voxel_bin = img_data[bin_start:bin_stop, t_obs.ravel()]
     
     
         # Compute the transform from seen data as follows for sin and cos terms:
         # termfinal = sum(termmult,2)./sum(term.^2,2)
-        # Compute numerators and denominators, then divide
-
-            mult = np.zeros(shape=(angular_frequencies.shape[0],
-                                                n_samples_seen,
-                                                n_features))
-            for obs in range(0,n_samples_seen):
-                mult[:,obs,:]   = np.outer(cosine_term[:,obs],voxel_bin[:,obs])
-            
-            numerator = np.sum(mult,1)
-            denominator = np.sum(cosine_term**2,1)
-            cc = (numerator.T/denominator).T
+        # Compute numerators and denominators, then divide. The sum over
+        # seen samples of term*data is a matrix product, which avoids the
+        # frequencies x samples x voxels intermediate
+
+            numerator = np.dot(cosine_term, voxel_bin.T)
+            cc = (numerator.T/cosine_denominator).T
          
-            for obs in range(0,n_samples_seen):
-                mult[:,obs,:] = np.outer(sine_term[:,obs],voxel_bin[:,obs])
-            
-            numerator = np.sum(mult,1)
-            denominator = np.sum(sine_term**2,1)
-            ss = (numerator.T/denominator).T
+            numerator = np.dot(sine_term, voxel_bin.T)
+            ss = (numerator.T/sine_denominator).T
     
     
         # Interpolate over unseen epochs, reconstruct the time series
-            term_prod = np.sin(np.outer(angular_frequencies, all_samples))
-            term_recon = np.zeros(shape=(angular_frequencies.shape[0],nvol,n_features))
-            for i in range(angular_frequencies.shape[0]):
-                term_recon[i,:,:] = np.outer(term_prod[i,:],ss[i,:])
-
-            s_recon = np.sum(term_recon,0)
-
-            term_prod = np.cos(np.outer(angular_frequencies, all_samples))
-            term_recon = np.zeros(shape=(angular_frequencies.shape[0],
-                                                nvol,n_features))
-            for i in range(angular_frequencies.shape[0]):
-                term_recon[i,:,:] = np.outer(term_prod[i,:],cc[i,:])
-            c_recon = np.sum(term_recon,0)   
+        # (sum over frequencies of basis*coefficient, again a matrix product)
+            s_recon = np.dot(sine_recon, ss)
+            c_recon = np.dot(cosine_recon, cc)
     
             recon = (c_recon + s_recon).T
             del c_recon, s_recon
@@ -203,12 +191,12 @@ def interpolate_masked_data(img_datax,tmask,mask_data=None,
             std_orig = np.std(voxel_bin,1,ddof=1)
             norm_fac = std_recon/std_orig
             del std_recon, std_orig
-            recon = (recon.T/norm_fac).T
+            recon /= norm_fac[:,None]
             del norm_fac
        
         # Write the current bin into the image matrix. Replace only unseen
         # observations with their interpolated values.
-            img_data[np.ix_(bin_index,t_obs.ravel())] = recon[:,t_obs.ravel()]
+            img_data[bin_start:bin_stop, t_obs.ravel()] = recon[:,t_obs.ravel()]
         
             del recon
     
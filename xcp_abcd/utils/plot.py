@@ -10,9 +10,13 @@ import matplotlib.pyplot as plt
 from matplotlib import gridspec as mgs
 import matplotlib.cm as cm
 from matplotlib.colors import ListedColormap, Normalize
+from matplotlib.collections import LineCollection
 import seaborn as sns
 from seaborn import color_palette
 
+# rows of the data matrix differenced at a time in compute_dvars
+DVARS_BLOCK_ROWS = 4096
+
 
 def plot_svg(fdata,fd,dvars,filename,tr=1):
     '''
@@ -36,6 +40,9 @@ def plot_svg(fdata,fd,dvars,filename,tr=1):
     confoundplot(dvars, grid[1], tr=tr, color='r', name='DVARS')
     plot_carpet(func_data=fdata,subplot=grid[-1], tr=tr,)
     fig.savefig(filename,bbox_inches="tight", pad_inches=None)
+    # free the canvas, the figure is not used after saving
+    fig.clear()
+    plt.close(fig)
 
 def compute_dvars(datat):
     '''
@@ -45,10 +52,17 @@ def compute_dvars(datat):
         data matrix vertices by timepoints 
      
     '''
-    firstcolumn=np.zeros((datat.shape[0]))[...,None]
-    datax=np.hstack((firstcolumn,np.diff(datat)))
-    datax_ss=np.sum(np.square(datax),axis=0)/datat.shape[0]
-    return np.sqrt(datax_ss)
+    # first timepoint has no backward difference, its dvars is zero
+    dvars = np.zeros(datat.shape[1])
+    # accumulate the squared differences over blocks of rows so only a
+    # block-sized diff is ever allocated, squared in place
+    sumsq = np.zeros(datat.shape[1] - 1)
+    for start in range(0, datat.shape[0], DVARS_BLOCK_ROWS):
+        diff = np.diff(datat[start:start + DVARS_BLOCK_ROWS], axis=1)
+        np.square(diff, out=diff)
+        sumsq += diff.sum(axis=0)
+    dvars[1:] = np.sqrt(sumsq / datat.shape[0])
+    return dvars
 
 
 def plot_carpet(func_data,detrend=True, nskip=0, size=(950, 800),
@@ -89,13 +103,15 @@ def plot_carpet(func_data,detrend=True, nskip=0, size=(950, 800),
 
     data = func_data.reshape(-1, ntsteps)
 
-    p_dec = 1 + data.shape[0] // size[0]
-    if p_dec:
-        data = data[::p_dec, :]
+    # only stride when the matrix is larger than the plot size, and keep
+    # the result contiguous for the detrending below
+    p_dec = max(1, data.shape[0] // size[0])
+    if p_dec > 1:
+        data = np.ascontiguousarray(data[::p_dec, :])
 
-    t_dec = 1 + data.shape[1] // size[1]
-    if t_dec:
-        data = data[:, ::t_dec]
+    t_dec = max(1, data.shape[1] // size[1])
+    if t_dec > 1:
+        data = np.ascontiguousarray(data[:, ::t_dec])
 
     # Detrend data
     v = (None, None)
@@ -113,7 +129,9 @@ def plot_carpet(func_data,detrend=True, nskip=0, size=(950, 800),
                                      wspace=0.0)
     # Carpet plot
     ax1 = plt.subplot(gs[1])
-    ax1.imshow(data, interpolation='nearest', aspect='auto', cmap='gray',
+    # 'none' lets vector backends (svg, pdf) embed the decimated matrix at
+    # its own resolution instead of resampling it to the figure size
+    ax1.imshow(data, interpolation='none', aspect='auto', cmap='gray',
                vmin=v[0], vmax=v[1])
     ax1.grid(False)
     ax1.set_yticks([])
@@ -122,13 +140,13 @@ def plot_carpet(func_data,detrend=True, nskip=0, size=(950, 800),
     # Set 10 frame markers in X axis
     interval = max((int(data.shape[-1] + 1) //
                     10, int(data.shape[-1] + 1) // 5, 1))
-    xticks = list(range(0, data.shape[-1])[::interval])
+    xticks = np.arange(0, data.shape[-1], interval)
     ax1.set_xticks(xticks)
     if notr:
         ax1.set_xlabel('time (frame #)')
     else:
         ax1.set_xlabel('time (s)')
-    labels = tr * (np.array(xticks)) * t_dec
+    labels = tr * xticks * t_dec
     ax1.set_xticklabels(['%.02f' % t for t in labels.tolist()], fontsize=10)
 
     # Remove and redefine spines
@@ -144,6 +162,7 @@ def plot_carpet(func_data,detrend=True, nskip=0, size=(950, 800),
     if output_file is not None:
         figure = plt.gcf()
         figure.savefig(output_file, bbox_inches='tight')
+        figure.clear()
         plt.close(figure)
         figure = None
         return output_file
@@ -186,7 +205,7 @@ def confoundplot(tseries, gs_ts, gs_dist=None, name=None,
 
     # Set 10 frame markers in X axis
     interval = max((ntsteps // 10, ntsteps // 5, 1))
-    xticks = list(range(0, ntsteps)[::interval])
+    xticks = np.arange(0, ntsteps, interval)
     ax_ts.set_xticks(xticks)
 
     if not hide_x:
@@ -194,7 +213,7 @@ def confoundplot(tseries, gs_ts, gs_dist=None, name=None,
             ax_ts.set_xlabel('time (frame #)')
         else:
             ax_ts.set_xlabel('time (s)')
-            labels = tr * np.array(xticks)
+            labels = tr * xticks
             ax_ts.set_xticklabels(['%.02f' % t for t in labels.tolist()])
     else:
         ax_ts.set_xticklabels([])
@@ -232,9 +251,10 @@ def confoundplot(tseries, gs_ts, gs_dist=None, name=None,
     nonnan = tseries[~np.isnan(tseries)]
     if nonnan.size > 0:
         # Calculate Y limits
-        valrange = (nonnan.max() - nonnan.min())
-        def_ylims = [nonnan.min() - 0.1 * valrange,
-                     nonnan.max() + 0.1 * valrange]
+        minv, p95, maxv = np.quantile(nonnan, [0., 0.95, 1.])
+        valrange = (maxv - minv)
+        def_ylims = [minv - 0.1 * valrange,
+                     maxv + 0.1 * valrange]
         if ylims is not None:
             if ylims[0] is not None:
                 def_ylims[0] = min([def_ylims[0], ylims[0]])
@@ -247,10 +267,8 @@ def confoundplot(tseries, gs_ts, gs_dist=None, name=None,
         ax_ts.set_ylim(def_ylims)
 
         # Annotate stats
-        maxv = nonnan.max()
         mean = nonnan.mean()
         stdv = nonnan.std()
-        p95 = np.percentile(nonnan, 95.0)
     else:
         maxv = 0
         mean = 0
@@ -278,24 +296,69 @@ def confoundplot(tseries, gs_ts, gs_dist=None, name=None,
     if cutoff is None:
         cutoff = []
 
-    for thr in enumerate(cutoff):
-        ax_ts.plot((0, ntsteps - 1), [thr] * 2,
-                   linewidth=.2, color='dimgray')
+    # all threshold lines in one artist
+    if len(cutoff) > 0:
+        ax_ts.add_collection(LineCollection(
+            [[(0, thr), (ntsteps - 1, thr)] for thr in cutoff],
+            linewidths=.2, colors='dimgray'))
 
+    for thr in cutoff:
         ax_ts.annotate(
             '%.2f' % thr, xy=(0, thr), xytext=(-1, 0),
             textcoords='offset points', va='center', ha='right',
             color='dimgray', size=3)
 
-    ax_ts.plot(tseries, color=color, linewidth=1.5)
+    # keep only min/max/first/last per horizontal pixel, the drawn line
+    # is the same but long series render with far fewer vertices
+    fig = ax_ts.get_figure()
+    n_pixels = int(ax_ts.get_position().width * fig.get_figwidth() * fig.dpi)
+    xvals, yvals = _m4_aggregate(tseries, n_pixels)
+    ax_ts.plot(xvals, yvals, color=color, linewidth=1.5)
     ax_ts.set_xlim((0, ntsteps - 1))
 
     if gs_dist is not None:
         ax_dist = plt.subplot(gs_dist)
-        sns.distplot(tseries, vertical=True, ax=ax_dist)
+        # histplot bins the series and fits the kde on a fixed grid,
+        # distplot is deprecated and refits scipy's gaussian_kde per call
+        sns.histplot(y=tseries, stat='density', kde=True, ax=ax_dist,
+                     kde_kws={'gridsize': 100})
         ax_dist.set_xlabel('Timesteps')
         ax_dist.set_ylim(ax_ts.get_ylim())
         ax_dist.set_yticklabels([])
 
         return [ax_ts, ax_dist], gs
     return ax_ts, gs
+
+
+def _m4_aggregate(tseries, n_pixels):
+    """
+    M4 downsampling of a time series for line plots
+    for every bucket of samples (one per horizontal pixel) keep the first,
+    last, minimum and maximum sample, which draws the same line as the full
+    series at that resolution.
+
+    tseries: numpy array
+       1D time series, returned whole if it holds nan (the gaps must be
+       drawn where they are)
+    n_pixels: int
+       number of buckets, usually the axes width in pixels
+    return:
+       indices and values of the kept samples
+    """
+    ntsteps = len(tseries)
+    if n_pixels < 1 or ntsteps <= 4 * n_pixels or np.isnan(tseries).any():
+        return np.arange(ntsteps), tseries
+
+    bsize = -(-ntsteps // n_pixels)
+    nbuckets = -(-ntsteps // bsize)
+    starts = np.arange(nbuckets) * bsize
+    padded = np.full(nbuckets * bsize, np.nan)
+    padded[:ntsteps] = tseries
+    padded = padded.reshape(nbuckets, bsize)
+
+    keep = np.concatenate((starts,
+                           np.minimum(starts + bsize - 1, ntsteps - 1),
+                           starts + np.nanargmin(padded, axis=1),
+                           starts + np.nanargmax(padded, axis=1)))
+    keep = np.unique(keep)
+    return keep, tseries[keep]
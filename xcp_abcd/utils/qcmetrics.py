@@ -1,15 +1,99 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import nibabel as nb
 import numpy as np
 
 def regisQ(bold2t1w_mask,t1w_mask,bold2template_mask,template_mask):
-	reg_qc ={'coregDice': [dc(bold2t1w_mask,t1w_mask)], 'coregJaccard': [jc(bold2t1w_mask,t1w_mask)],
-              'coregCrossCorr': [crosscorr(bold2t1w_mask,t1w_mask)],'coregCoverag': [coverage(bold2t1w_mask,t1w_mask)],
-	      'normDice': [dc(bold2template_mask,template_mask)],'normJaccard': [jc(bold2template_mask,template_mask)], 
-	      'normCrossCorr': [crosscorr(bold2template_mask,template_mask)], 'normCoverage': [coverage(bold2template_mask,template_mask)],
+	# the (gzipped) masks are inflated in parallel, zlib releases the gil;
+	# each distinct file is read once and all metrics use the counts
+	mask_files = (bold2t1w_mask,t1w_mask,bold2template_mask,template_mask)
+	paths = [os.path.abspath(m) for m in mask_files]
+	unique = list(dict.fromkeys(paths))
+	with ThreadPoolExecutor(max_workers=len(unique)) as executor:
+		masks = dict(zip(unique, executor.map(_load_mask, unique)))
+	coreg = _counts(masks[paths[0]],masks[paths[1]])
+	norm = _counts(masks[paths[2]],masks[paths[3]])
+	reg_qc ={'coregDice': [_dice(*coreg)], 'coregJaccard': [_jaccard(*coreg)],
+              'coregCrossCorr': [_phi(*coreg)],'coregCoverag': [_coverage(*coreg)],
+	      'normDice': [_dice(*norm)],'normJaccard': [_jaccard(*norm)], 
+	      'normCrossCorr': [_phi(*norm)], 'normCoverage': [_coverage(*norm)],
 	      }
 	return reg_qc
 
 
+def _load_mask(mask):
+    """
+    read a mask file as a boolean array straight from the on-disk dtype,
+    without the float64 copy get_fdata would make
+    """
+    img = nb.load(mask)
+    return np.atleast_1d(np.asanyarray(img.dataobj) != 0)
+
+
+def _mask_counts(input1, input2):
+    """
+    sizes of the two binary mask files and of their intersection
+    """
+    mask1 = _load_mask(input1)
+    if os.path.abspath(input1) == os.path.abspath(input2):
+        # same file on both sides, no need to read it twice
+        mask2 = mask1
+    else:
+        mask2 = _load_mask(input2)
+    return _counts(mask1, mask2)
+
+
+def _counts(mask1, mask2):
+    """
+    sizes of two boolean masks, of their intersection and number of voxels
+    """
+    size_i1 = np.count_nonzero(mask1)
+    if mask2 is mask1:
+        # the overlap is the mask itself
+        return size_i1, size_i1, size_i1, mask1.size
+
+    size_i2 = np.count_nonzero(mask2)
+    if size_i1 == 0 or size_i2 == 0:
+        # nothing can overlap an empty mask, skip the intersection pass
+        intersection = 0
+    else:
+        intersection = np.count_nonzero(mask1 & mask2)
+    return size_i1, size_i2, intersection, mask1.size
+
+
+def _dice(size_i1, size_i2, intersection, n):
+    try:
+        dc = 2. * intersection / float(size_i1 + size_i2)
+    except ZeroDivisionError:
+        dc = 0.0
+    return dc
+
+
+def _jaccard(size_i1, size_i2, intersection, n):
+    # |A u B| = |A| + |B| - |A n B|
+    union = size_i1 + size_i2 - intersection
+    if union == 0:
+        return 0.0
+    return float(intersection) / float(union)
+
+
+def _coverage(size_i1, size_i2, intersection, n):
+    smallv = min(size_i1, size_i2)
+    if smallv == 0:
+        return 0.0
+    return float(intersection)/float(smallv)
+
+
+def _phi(size_i1, size_i2, intersection, n):
+    # pearson correlation of two binary vectors from their counts alone
+    size_i1, size_i2, n = float(size_i1), float(size_i2), float(n)
+    denom = np.sqrt(size_i1 * size_i2 * (n - size_i1) * (n - size_i2))
+    if denom == 0:
+        # one of the masks is empty or full, correlation is undefined
+        return np.nan
+    return (n * intersection - size_i1 * size_i2) / denom
+
+
 
 def dc(input1, input2):
     r"""
@@ -37,22 +121,7 @@ def dc(input1, input2):
     -----
     This is a real metric.
     """
-    input1 = nb.load(input1).get_fdata()
-    input2 = nb.load(input2).get_fdata()
-    input1 = np.atleast_1d(input1.astype(np.bool))
-    input2 = np.atleast_1d(input2.astype(np.bool))
-
-    intersection = np.count_nonzero(input1 & input2)
-
-    size_i1 = np.count_nonzero(input1)
-    size_i2 = np.count_nonzero(input2)
-
-    try:
-        dc = 2. * intersection / float(size_i1 + size_i2)
-    except ZeroDivisionError:
-        dc = 0.0
-
-    return dc
+    return _dice(*_mask_counts(input1, input2))
 
 
 def jc(input1, input2):
@@ -76,17 +145,7 @@ def jc(input1, input2):
     -----
     This is a real metric.
     """
-    input1 = nb.load(input1).get_fdata()
-    input2 = nb.load(input2).get_fdata()
-    input1 = np.atleast_1d(input1.astype(np.bool))
-    input2 = np.atleast_1d(input2.astype(np.bool))
-
-    intersection = np.count_nonzero(input1 & input2)
-    union = np.count_nonzero(input1 | input2)
-
-    jc = float(intersection) / float(union)
-
-    return jc
+    return _jaccard(*_mask_counts(input1, input2))
 
 
 def crosscorr(input1, input2):
@@ -94,26 +153,11 @@ def crosscorr(input1, input2):
     cross correlation
     computer compute cross correction bewteen input mask
     """
-    input1 = nb.load(input1).get_fdata()
-    input2 = nb.load(input2).get_fdata()
-    input1 = np.atleast_1d(input1.astype(np.bool)).flatten()
-    input2 = np.atleast_1d(input2.astype(np.bool)).flatten()
-    cc = np.corrcoef(input1, input2)[0][1]
-    return cc
+    return _phi(*_mask_counts(input1, input2))
 
 
 def coverage(input1, input2):
     """
     estimate the coverage between  two mask
     """
-    input1 = nb.load(input1).get_fdata()
-    input2 = nb.load(input2).get_fdata()
-    input1 = np.atleast_1d(input1.astype(np.bool))
-    input2 = np.atleast_1d(input2.astype(np.bool))
-    intsec = np.count_nonzero(input1 & input2)
-    if np.sum(input1) > np.sum(input2):
-        smallv = np.sum(input2)
-    else:
-        smallv = np.sum(input1)
-    cov = float(intsec)/float(smallv)
-    return cov
\ No newline at end of file
+    return _coverage(*_mask_counts(input1, input2))
\ No newline at end of file
@@ -26,6 +26,10 @@ KNOWN_ERRORS = {
         "KeyboardInterrupt",
     ],
 }
+# Patterns used on every crashfile / event, compiled once
+FILE_PATH_RE = re.compile(r"(/[^/ ]*)+/?")
+WORD_WITH_DIGITS_RE = re.compile(r"([a-zA-Z]*[0-9]+[a-zA-Z]*)+")
+NODE_FAILED_RE = re.compile("Node .+ failed to run on host .+")
 
 def start_ping(run_uuid, npart):
     with sentry_sdk.configure_scope() as scope:
@@ -53,10 +57,8 @@ def sentry_setup(opts, exec_env):
     sentry_sdk.init("https://729b52a70da149da97c69af55eebc4eb@o317280.ingest.sentry.io/5645951",
                     release=release,
                     environment=environment,
-                    before_send=before_send)
-    sentry_sdk.init(
-    "https://729b52a70da149da97c69af55eebc4eb@o317280.ingest.sentry.io/5645951",
-     traces_sample_rate=1.0)
+                    before_send=before_send,
+                    traces_sample_rate=1.0)
     with sentry_sdk.configure_scope() as scope:
         scope.set_tag('exec_env', exec_env)
         free_mem_at_start = round(psutil.virtual_memory().free / 1024**3, 1)
@@ -85,8 +87,9 @@ def sentry_setup(opts, exec_env):
             scope.set_tag('overcommit_memory', 'n/a')
             scope.set_tag('overcommit_limit', 'n/a')
 
-        for k, v in vars(opts).items():
-            scope.set_tag(k, v)
+        # command-line options as one structured context rather than a tag
+        # each, which also keeps them out of sentry's per-event tag limit
+        scope.set_context('cli_opts', {k: str(v) for k, v in vars(opts).items()})
 
 
 def process_crashfile(crashfile):
@@ -143,9 +146,9 @@ def process_crashfile(crashfile):
             sentry_sdk.add_breadcrumb(message=fingerprint, level='fatal')
         else:
             # remove file paths
-            fingerprint = re.sub(r"(/[^/ ]*)+/?", '', message)
+            fingerprint = FILE_PATH_RE.sub('', message)
             # remove words containing numbers
-            fingerprint = re.sub(r"([a-zA-Z]*[0-9]+[a-zA-Z]*)+", '', fingerprint)
+            fingerprint = WORD_WITH_DIGITS_RE.sub('', fingerprint)
             # adding the return code if it exists
             for line in message.splitlines():
                 if line.startswith("Return code"):
@@ -164,7 +167,7 @@ def before_send(event, hints):
             return None
         if msg.startswith("Saving crash info to "):
             return None
-        if re.match("Node .+ failed to run on host .+", msg):
+        if NODE_FAILED_RE.match(msg):
             return None
 
     if 'breadcrumbs' in event and isinstance(event['breadcrumbs'], list):
@@ -4,6 +4,9 @@ from templateflow.api import get as get_template
 import numpy as np
 from pkg_resources import resource_filename as pkgrf
 
+# resolve packaged transforms once at import, not on every bold file
+FSL2MNI9 = pkgrf('xcp_abcd', 'data/transform/FSL2MNI9Composite.h5')
+
 def get_transformfilex(bold_file,mni_to_t1w,t1w_to_native):
 
     file_base = os.path.basename(str(bold_file))
@@ -82,7 +85,6 @@ def get_maskfiles(bold_file,mni_to_t1w):
 def get_transformfile(bold_file,mni_to_t1w,t1w_to_native):
 
     file_base = os.path.basename(str(bold_file))
-    FSL2MNI9  = pkgrf('xcp_abcd', 'data/transform/FSL2MNI9Composite.h5')
   #MNI6 = str(get_template(template='MNI152NLin2009cAsym',mode='image',suffix='xfm')[0])
      
     if 'space-MNI152NLin6Asym' in file_base:
@@ -23,9 +23,11 @@ def read_ndata(datafile,maskfile=None):
         data = nb.load(datafile).get_fdata().T
     # or nifiti data, mask is required
     elif datafile.endswith('.nii.gz'):
-        datax = nb.load(datafile).get_fdata()
-        mask = nb.load(maskfile).get_fdata()
-        data = datax[mask==1]
+        # keep the on-disk dtype until the brain voxels are gathered, so only
+        # the masked matrix is promoted to float64
+        datax = np.asanyarray(nb.load(datafile).dataobj)
+        mask = np.asanyarray(nb.load(maskfile).dataobj)
+        data = datax[mask==1].astype(np.float64)
     return data
     
 
@@ -49,12 +51,14 @@ def write_ndata(data_matrix,template,filename,mask=None,tr=1):
                     file_map=template_file.file_map,nifti_header=template_file.nifti_header)
         elif data_matrix.shape[1] != template_file.shape[0]:
             fake_cifti1 = str(basedir+'/fake_niftix.nii.gz')
-            run_shell(['OMP_NUM_THREADS=2 wb_command -cifti-convert -to-nifti ',template,fake_cifti1])
+            run_shell(['wb_command','-cifti-convert','-to-nifti',template,fake_cifti1],
+                      env=_wb_env(),check=True)
             fake_cifti0 = str(basedir+ '/edited_cifti_nifti.nii.gz')
             fake_cifti0 = edit_ciftinifti(fake_cifti1,fake_cifti0,data_matrix)
             orig_cifti0 = str(basedir+ '/edited_nifti2cifti.dtseries.nii')
-            run_shell(['OMP_NUM_THREADS=2 wb_command  -cifti-convert -from-nifti  ',fake_cifti0,template, 
-                                   orig_cifti0,'-reset-timepoints',str(tr),str(0)  ])
+            run_shell(['wb_command','-cifti-convert','-from-nifti',fake_cifti0,template, 
+                                   orig_cifti0,'-reset-timepoints',str(tr),str(0)],
+                      env=_wb_env(),check=True)
             template_file2 = nb.load(orig_cifti0)
             dataimg = Cifti2Image(dataobj=data_matrix.T,header=template_file2.header,
                     file_map=template_file2.file_map,nifti_header=template_file2.nifti_header)
@@ -93,31 +97,34 @@ def edit_ciftinifti(in_file,out_file,datax):
       data matrix with vertices by timepoints dimension
     """
     thdata = nb.load(in_file)
-    dataxx = thdata.get_fdata()
-    dd = dataxx[:,:,:,0:datax.shape[1]]
+    # slice the proxy so only the needed timepoints are read and scaled
+    dd = thdata.dataobj[:,:,:,0:datax.shape[1]]
     dataimg = nb.Nifti1Image(dataobj=dd, affine=thdata.affine, 
                  header=thdata.header)
     dataimg.to_filename(out_file)
     return out_file
 
-def run_shell(cmd,env = os.environ):
+def run_shell(cmd,env = os.environ,check=False):
     """
     utilities to run shell in python
     cmd: 
-     shell command that wanted to be run 
-     
+     command that wanted to be run, an argument list is executed
+     directly; a string goes through the shell
+    check:
+     raise subprocess.CalledProcessError if the command fails
 
     """
-    if type(cmd) is list:
-        cmd = ' '.join(cmd)
-    
-    call_command = subprocess.Popen(cmd,stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,env=env,shell=True,)
-    output, error = call_command.communicate("Hello from the other side!")
-    call_command.wait()
-    
+    # an argument list needs no /bin/sh in between nor any quoting
+    shell = not isinstance(cmd, (list, tuple))
+    call_command = subprocess.run(cmd,stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,env=env,shell=shell,check=check)
+
+    return call_command.stdout,call_command.stderr
+
 
-    return output,error
+def _wb_env():
+    """environment for wb_command, limited to two openmp threads"""
+    return dict(os.environ, OMP_NUM_THREADS='2')
     
 
 
@@ -157,8 +164,16 @@ def despikedatacifti(cifti,tr,basedir):
     fake_cifti1 = str(basedir+'/fake_niftix.nii.gz')
     fake_cifti1_depike = str(basedir+'/fake_niftix_depike.nii.gz')
     cifti_despike = str(basedir+ '/despike_nifti2cifti.dtseries.nii')
-    run_shell(['OMP_NUM_THREADS=2 wb_command -cifti-convert -to-nifti ',cifti,fake_cifti1])
-    run_shell(['3dDespike -nomask -NEW -prefix',fake_cifti1_depike,fake_cifti1])
-    run_shell(['OMP_NUM_THREADS=2 wb_command  -cifti-convert -from-nifti  ',fake_cifti1_depike,cifti, 
-                                   cifti_despike,'-reset-timepoints',str(tr),str(0)])
+    run_shell(['wb_command','-cifti-convert','-to-nifti',cifti,fake_cifti1],
+              env=_wb_env(),check=True)
+    run_shell(['3dDespike','-nomask','-NEW','-prefix',fake_cifti1_depike,fake_cifti1],
+              check=True)
+    run_shell(['wb_command','-cifti-convert','-from-nifti',fake_cifti1_depike,cifti, 
+                                   cifti_despike,'-reset-timepoints',str(tr),str(0)],
+              env=_wb_env(),check=True)
+    # the two intermediate niftis are full copies of the series, only the
+    # rebuilt cifti is kept; a failed step raises above and leaves them
+    # in place for inspection
+    os.remove(fake_cifti1)
+    os.remove(fake_cifti1_depike)
     return cifti_despike
\ No newline at end of file